@@ -15,63 +15,278 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import collections
+import collections.abc
+import dataclasses
 import dateutil.parser
 import datetime
+import functools
 import requests
+import requests.adapters
+import typing
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    def _parse_iso(timestamp):
+        if timestamp.endswith("Z"):
+            timestamp = timestamp[:-1] + "+00:00"
+        return datetime.datetime.fromisoformat(timestamp)
 
 from .exceptions import APIError
 
 
+__all__ = ['C3TOCAPI', 'TrainState']
+
+_DEFAULT_HEADERS = {
+    'Accept': "application/json",
+    'Accept-Encoding': "gzip, deflate",
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_timestamp(timestamp):
+    """
+    Parses an ISO 8601 timestamp as returned by the API
+    into a naive datetime. Any UTC offset is dropped, not applied.
+    Results are cached since a train's timestamp usually stays
+    the same over several polling cycles.
+    """
+    try:
+        parsed = _parse_iso(timestamp)
+    except ValueError:
+        # Fall back to the more lenient but much slower dateutil parser
+        parsed = dateutil.parser.isoparse(timestamp)
+    return parsed.replace(tzinfo=None)
+
+
+@dataclasses.dataclass(slots=True)
+class TrainState(collections.abc.Mapping):
+    """
+    Tracked state of a single train as returned by get_train_info.
+    Also behaves as a read-only mapping (state['eta'], state.get('eta'),
+    dict(state)) for compatibility with the previously used dicts.
+    """
+    history: collections.deque = dataclasses.field(default_factory=collections.deque)
+    avg_speed: typing.Optional[float] = 0.0
+    raw_eta: typing.Optional[datetime.datetime] = None
+    eta: typing.Optional[datetime.datetime] = None
+    arrived: bool = False
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __iter__(self):
+        return iter(self.__slots__)
+    
+    def __len__(self):
+        return len(self.__slots__)
+
+
 class C3TOCAPI:
-    def __init__(self, host="api.c3toc.de"):
+    def __init__(self, host="api.c3toc.de", timeout=(2, 5)):
+        # timeout: (connect, read) timeouts in seconds
         self.host = host
+        self.timeout = timeout
         self.train_info = {}
+        # Arguments of the last get_train_info call
+        self._train_info_args = None
+        self._urls = {
+            (endpoint, format): "https://{host}/{endpoint}.{format}".format(host=host, endpoint=endpoint, format=format)
+            for endpoint in ("trains", "tracks")
+            for format in ("json", "geojson")
+        }
+        # Reuse one connection for all requests to the API host
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers.update(_DEFAULT_HEADERS)
+        # Validators and decoded payloads of the last responses,
+        # keyed by (endpoint, format)
+        self._etag = {}
+        self._last_modified = {}
+        self._last_payload = {}
+        # Async client, created on first use of the async methods,
+        # and the event loop it belongs to
+        self._aclient = None
+        self._aclient_loop = None
     
-    def get_trains(self, format="json"):
-        if format not in ("json", "geojson"):
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+        self.close()
+    
+    def close(self):
+        self.session.close()
+    
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+            self._aclient_loop = None
+    
+    def _prepare_request(self, endpoint, format):
+        key = (endpoint, format)
+        try:
+            url = self._urls[key]
+        except KeyError:
             raise ValueError("Unknown data format: {format}".format(format=format))
-        response = requests.get("https://{host}/trains.{format}".format(host=self.host, format=format))
+        # Conditional GET: if the data hasn't changed since the last request,
+        # the server answers with 304 and we can return the cached payload.
+        headers = {}
+        if key in self._etag:
+            headers['If-None-Match'] = self._etag[key]
+        if key in self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified[key]
+        return key, url, headers
+    
+    def _handle_response(self, key, response):
+        # The cached payload is shared between calls, not copied
+        if response.status_code == 304 and key in self._last_payload:
+            return self._last_payload[key]
         if response.status_code != 200:
             raise APIError("Server returned HTTP status {code}".format(code=response.status_code))
-        data = response.json()
+        data = _json_loads(response.content)
+        # Replace the validators so they always belong to the stored payload
+        if 'ETag' in response.headers:
+            self._etag[key] = response.headers['ETag']
+        else:
+            self._etag.pop(key, None)
+        if 'Last-Modified' in response.headers:
+            self._last_modified[key] = response.headers['Last-Modified']
+        else:
+            self._last_modified.pop(key, None)
+        self._last_payload[key] = data
         return data
     
+    def _get(self, endpoint, format):
+        key, url, headers = self._prepare_request(endpoint, format)
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        return self._handle_response(key, response)
+    
+    async def _get_async(self, endpoint, format):
+        key, url, headers = self._prepare_request(endpoint, format)
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            # The client's connections are bound to the event loop it was
+            # created on, so e.g. every asyncio.run() call needs a new one.
+            # A client left over from a closed loop can't be closed anymore.
+            if httpx is None:
+                raise ImportError("httpx is required for async requests")
+            timeout = self.timeout
+            if isinstance(timeout, tuple):
+                timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+            self._aclient = httpx.AsyncClient(http2=True, headers=_DEFAULT_HEADERS, timeout=timeout)
+            self._aclient_loop = loop
+        response = await self._aclient.get(url, headers=headers)
+        return self._handle_response(key, response)
+    
+    def get_trains(self, format="json"):
+        """
+        Returns the decoded trains data.
+        If the server reports the data as unchanged, the object returned
+        by the previous call is returned again, so it must not be modified.
+        """
+        return self._get("trains", format)
+    
     def get_tracks(self, format="json"):
-        if format not in ("json", "geojson"):
-            raise ValueError("Unknown data format: {format}".format(format=format))
-        response = requests.get("https://{host}/tracks.{format}".format(host=self.host, format=format))
-        if response.status_code != 200:
-            raise APIError("Server returned HTTP status {code}".format(code=response.status_code))
-        data = response.json()
-        return data
+        """
+        Returns the decoded tracks data.
+        If the server reports the data as unchanged, the object returned
+        by the previous call is returned again, so it must not be modified.
+        """
+        return self._get("tracks", format)
+    
+    async def get_trains_async(self, format="json"):
+        return await self._get_async("trains", format)
+    
+    async def get_tracks_async(self, format="json"):
+        return await self._get_async("tracks", format)
+    
+    async def poll(self, format="json"):
+        """
+        Fetches trains and tracks concurrently.
+        Returns a tuple of both decoded responses.
+        Like the other async methods, this should be used within
+        'async with api:' so the async client gets closed, e.g.
+        
+            async def main():
+                async with api:
+                    trains, tracks = await api.poll()
+            asyncio.run(main())
+        """
+        trains, tracks = await asyncio.gather(self.get_trains_async(format), self.get_tracks_async(format))
+        return trains, tracks
     
-    def _calc_avg_speed(self, history, minutes, track_length):
+    def _calc_avg_speed(self, history, track_length, cutoff, now):
         """
         Calculates the average speed in trackmarker units per second
-        over the last <minutes> minutes.
-        Returns the average speed , time range and the history list
-        with any entries older than specified removed.
+        between <cutoff> and <now>.
+        Returns the average speed and time range.
+        Entries older than <cutoff> are removed from the history deque
+        in place; timestamps are expected to be in ascending order.
         The calculation assumes that the train does not make
         more than one round within the lookback period.
         """
-        new_history = []
-        now = datetime.datetime.utcnow()
-        for timestamp, trackmarker in history:
-            delta = now - timestamp
-            seconds = delta.total_seconds()
-            if seconds > minutes * 60 or seconds < 0:
-                # Also filter out timestamps in the future, just to be sure
-                continue
-            new_history.append((timestamp, trackmarker))
-        if len(new_history) < 2:
+        while history and history[0][0] < cutoff:
+            history.popleft()
+        # Also filter out timestamps in the future, just to be sure
+        while history and history[-1][0] > now:
+            history.pop()
+        if len(history) < 2:
             # Can't calculate an average yet
-            return None, None, None
-        trackmarker_delta = (new_history[-1][1] - new_history[0][1])
-        if trackmarker_delta < 0:
-            trackmarker_delta += track_length
-        seconds_delta = (new_history[-1][0] - new_history[0][0]).total_seconds()
+            return None, None
+        trackmarker_delta = (history[-1][1] - history[0][1]) % track_length
+        seconds_delta = (history[-1][0] - history[0][0]).total_seconds()
         avg_speed = trackmarker_delta / seconds_delta
-        return avg_speed, seconds_delta, new_history
+        return avg_speed, seconds_delta
+    
+    def _calc_eta(self, history, trackmarker_delta, avg_speed, seconds_delta, prev_eta, max_jump, allow_jump):
+        """
+        Calculates the raw ETA by linear extrapolation from the last
+        history entry and the soft ETA, which may only move by
+        <max_jump> (a timedelta) per cycle relative to <prev_eta>
+        unless <allow_jump> is set.
+        Returns the raw ETA and soft ETA, or None for both
+        if no ETA can be calculated yet.
+        """
+        # Skip ETA calculation if average speed is 0 or history spans less than 2 minutes
+        if avg_speed == 0 or seconds_delta is None or seconds_delta < 2 * 60:
+            return None, None
+        
+        # The raw ETA is just the last history timestamp plus the linearly extrapolated time
+        raw_eta = history[-1][0] + datetime.timedelta(seconds=(trackmarker_delta / avg_speed))
+        
+        # Calculate soft ETA based on raw ETA. It is only allowed to vary by so much in one cycle
+        if allow_jump:
+            # If we allowed an ETA jump, ignore limitations
+            return raw_eta, raw_eta
+        eta = prev_eta or raw_eta
+        delta = raw_eta - eta
+        clamped = max(-max_jump, min(delta, max_jump))
+        if clamped == delta:
+            return raw_eta, raw_eta
+        return raw_eta, eta + clamped
     
     def get_train_info(self, display_trackmarker, eta_lookback, eta_max_jump, trackmarker_delta_arrived, track_length):
         # display_trackmarker: Physical trackmarker position of the display
@@ -81,85 +296,61 @@ class C3TOCAPI:
         # track_length: Length of the track in track units
         
         utcnow = datetime.datetime.utcnow()
+        cutoff = utcnow - datetime.timedelta(minutes=eta_lookback)
+        max_jump = datetime.timedelta(seconds=eta_max_jump)
+        args = (display_trackmarker, eta_lookback, eta_max_jump, trackmarker_delta_arrived, track_length)
+        args_unchanged = args == self._train_info_args
+        # Forget the previous arguments until all trains have been updated,
+        # so an exception halfway through can't enable the fast path later
+        self._train_info_args = None
         
         # Get trains from API
-        trains = self.get_trains()['trains'].items()
-        for pos, train in enumerate(trains):
-            name, data = train
+        for name, data in self.get_trains()['trains'].items():
             # Parse "last update" timestamp"
-            timestamp = dateutil.parser.isoparse(data['timestamp']).replace(tzinfo=None)
+            timestamp = _parse_timestamp(data['timestamp'])
             
             # Init train data if train is new
             if name not in self.train_info:
-                self.train_info[name] = {
-                    'history': [],
-                    'avg_speed': 0.0,
-                    'raw_eta': None,
-                    'eta': None,
-                    'arrived': False
-                }
+                self.train_info[name] = TrainState()
+            info = self.train_info[name]
+            history = info.history
             
-            # Add current location to history if timestamp not yet present
-            if timestamp not in [e[0] for e in self.train_info[name]['history']]:
-                self.train_info[name]['history'].append((timestamp, data['trackmarker']))
-            
-            # Calculate average speed
-            avg_speed, seconds_delta, history = self._calc_avg_speed(self.train_info[name]['history'], eta_lookback, track_length) # 5 minutes
+            # Fast path: the train hasn't reported a new position, no history
+            # entry has expired and the soft ETA has caught up with the raw ETA.
+            # Recalculating would yield exactly the current state.
+            if (args_unchanged and history and history[-1] == (timestamp, data['trackmarker'])
+                    and history[0][0] >= cutoff and timestamp <= utcnow
+                    and not info.arrived and info.eta == info.raw_eta):
+                continue
             
-            # Update average speed
-            self.train_info[name]['avg_speed'] = avg_speed
+            # Add current location to history if timestamp not yet present.
+            # Timestamps are monotonic, so only the newest entry needs checking.
+            if not history or history[-1][0] != timestamp:
+                history.append((timestamp, data['trackmarker']))
             
-            # Update history with truncated version returned by _calc_avg_speed
-            if history is not None:
-                self.train_info[name]['history'] = history
+            # Calculate average speed
+            avg_speed, seconds_delta = self._calc_avg_speed(history, track_length, cutoff, utcnow)
             
             # Calculate distance between display and train in track units
-            trackmarker_delta = display_trackmarker - data['trackmarker']
-            if trackmarker_delta < 0:
-                trackmarker_delta += track_length
+            trackmarker_delta = (display_trackmarker - data['trackmarker']) % track_length
             
-            # If train is within a certain distance, mark as arrived
-            allow_eta_jump = False
-            if trackmarker_delta < trackmarker_delta_arrived:
-                self.train_info[name]['arrived'] = True
-            else:
-                if self.train_info[name]['arrived']:
-                    # Train was marked as arrived, but isn't anymore.
-                    # This most likely means it has left the station.
-                    # This means we must allow the ETA to jump up.
-                    allow_eta_jump = True
-                self.train_info[name]['arrived'] = False
+            # If train is within a certain distance, mark as arrived.
+            # If it was marked as arrived but isn't anymore, it has most
+            # likely left the station, so we must allow the ETA to jump up.
+            arrived = trackmarker_delta < trackmarker_delta_arrived
+            allow_eta_jump = info.arrived and not arrived
             
             # Set ETA to now if train is marked as arrived
-            if self.train_info[name]['arrived']:
-                self.train_info[name]['eta'] = self.train_info[name]['raw_eta'] = utcnow
+            if arrived:
+                raw_eta = eta = utcnow
             else:
-                # Skip ETA calculation if average speed is 0 or history spans less than 2 minutes
-                if self.train_info[name]['avg_speed'] == 0 or seconds_delta is None or seconds_delta < 2 * 60:
-                    self.train_info[name]['raw_eta'] = None
-                else:
-                    # The raw ETA is just the last history timestamp plus the linearly extrapolated time
-                    self.train_info[name]['raw_eta'] = self.train_info[name]['history'][-1][0] + datetime.timedelta(seconds=(trackmarker_delta / self.train_info[name]['avg_speed']))
-                
-                # Calculate soft ETA based on raw ETA. It is only allowed to vary by so much in one cycle
-                if self.train_info[name]['raw_eta'] is not None:
-                    if allow_eta_jump:
-                        # If we allowed an ETA jump, ignore limitations and reset flag
-                        self.train_info[name]['eta'] = self.train_info[name]['raw_eta']
-                        allow_eta_jump = False
-                    else:
-                        eta = self.train_info[name]['eta'] or self.train_info[name]['raw_eta']
-                        delta = (self.train_info[name]['raw_eta'] - eta).total_seconds()
-                        
-                        if (delta > eta_max_jump):
-                            eta += datetime.timedelta(seconds=eta_max_jump)
-                        elif (delta < -eta_max_jump):
-                            eta -= datetime.timedelta(seconds=eta_max_jump)
-                        else:
-                            eta = self.train_info[name]['raw_eta']
-                    
-                        self.train_info[name]['eta'] = eta
-                else:
-                    self.train_info[name]['eta'] = None
+                raw_eta, eta = self._calc_eta(history, trackmarker_delta, avg_speed, seconds_delta, info.eta, max_jump, allow_eta_jump)
+            
+            # Update train state
+            info.avg_speed = avg_speed
+            info.arrived = arrived
+            info.raw_eta = raw_eta
+            info.eta = eta
+        self._train_info_args = args
         return self.train_info
             
\ No newline at end of file
@@ -21,6 +21,11 @@ description = "A Python wrapper for the c3toc API"
 license = "GPLv3"
 author = "Julian Metzler"
 author_email = "git@mezgr.de"
-requires = ['requests']
+python_requires = '>=3.10'
+requires = ['requests', 'python-dateutil']
+extras = {
+    'speedups': ['orjson', 'ciso8601'],
+    'async': ['httpx[http2]'],
+}
 url = "https://github.com/Mezgrman/pyc3toc"
 keywords = "library wrapper train api json"
\ No newline at end of file
@@ -11,7 +11,9 @@ setup(
 	license = metadata['license'],
 	author = metadata['author'],
 	author_email = metadata['author_email'],
+	python_requires = metadata['python_requires'],
 	install_requires = metadata['requires'],
+	extras_require = metadata['extras'],
 	url = metadata['url'],
 	keywords = metadata['keywords'],
 	packages = find_packages(),